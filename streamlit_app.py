@@ -1,39 +1,123 @@
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+import numpy as np
 import pandas as pd
+from pandas.api.types import CategoricalDtype
+import hashlib
+import io
+from concurrent.futures import ThreadPoolExecutor
 import os
 
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+except ImportError:  # pyarrow is optional; CSVs are then read with the pandas C parser
+    pa = None
+
+try:
+    from numba import njit
+except ImportError:  # Numba is optional; excess IDs are then copied with a Python loop over NumPy slices
+    njit = None
+
+try:
+    import polars as pl
+except ImportError:  # Polars is optional; grouping and joining then run in pandas
+    pl = None
+
+# Function to read a CSV file with pyarrow, dictionary-encoding the key columns
+def _read_csv_arrow(file):
+    key_type = pa.dictionary(pa.int32(), pa.string())
+    table = pacsv.read_csv(
+        file,
+        read_options=pacsv.ReadOptions(block_size=1 << 20, use_threads=True),
+        convert_options=pacsv.ConvertOptions(
+            column_types={col: key_type for col in ['Country', 'Industry', 'Revenue Range']},
+            strings_can_be_null=True  # Match pandas, which reads empty cells as missing
+        )
+    )
+    # Dictionary columns become pandas categoricals; everything else stays Arrow-backed
+    return table.to_pandas(types_mapper=lambda t: None if pa.types.is_dictionary(t) else pd.ArrowDtype(t))
+
 # Function to read a file (supports both CSV and Excel)
 def read_file(file):
     try:
         if file.name.endswith('.csv'):
+            # Prefer the multithreaded pyarrow parser; fall back to the default C parser if it isn't installed
+            if pa is not None:
+                return _read_csv_arrow(file)
             return pd.read_csv(file)
         elif file.name.endswith('.xlsx'):
-            return pd.read_excel(file)
+            # Prefer the Rust-backed calamine reader; fall back to openpyxl if it isn't installed
+            try:
+                return pd.read_excel(file, engine='calamine')
+            except ImportError:
+                file.seek(0)
+                return pd.read_excel(file)
         else:
             raise ValueError("Unsupported file format. Please upload a CSV or Excel file.")
     except Exception as e:
         raise ValueError(f"Error reading file: {str(e)}")
 
+# Function to hash a DataFrame's full contents for st.cache_data
+# (Streamlit's default hasher only samples 10,000 rows of frames with 50,000+ rows, so edits outside the sample hit stale entries)
+def _hash_dataframe(df):
+    digest = hashlib.sha256()
+    digest.update(repr((list(df.columns), [str(dtype) for dtype in df.dtypes])).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+# Function to read uploaded file bytes, cached on the file name and content across reruns
+@st.cache_data(show_spinner=False)
+def _read_bytes(name, data):
+    buffer = io.BytesIO(data)
+    buffer.name = name
+    return read_file(buffer)
+
+# Function to serialize a results table to CSV bytes for download, cached per unique result
+# (pandas' writer is kept over pyarrow's, whose quoting and float formatting would change the file format)
+@st.cache_data(show_spinner=False, hash_funcs={pd.DataFrame: _hash_dataframe})
+def _to_csv_bytes(df):
+    return df.to_csv(index=False).encode('utf-8')
+
 # Function to validate the data file
 def validate_data_file(df, revenue_ranges):
     required_columns = ['responseid', 'Country', 'Industry', 'Revenue Range']
-    missing_columns = [col for col in required_columns if col not in df.columns]
+    present_columns = set(df.columns)
+    missing_columns = [col for col in required_columns if col not in present_columns]
     if missing_columns:
         raise ValueError(f"Data file is missing required columns: {', '.join(missing_columns)}")
     
-    # Validate Revenue Range values
-    invalid_revenue_ranges = df['Revenue Range'].dropna().unique()
-    invalid_revenue_ranges = [r for r in invalid_revenue_ranges if r not in revenue_ranges]
-    if invalid_revenue_ranges:
-        raise ValueError(f"Data file contains invalid Revenue Range values: {', '.join(invalid_revenue_ranges)}. Expected values are: {', '.join(revenue_ranges)}")
+    # Validate responseid values (a blank ID can't be reported and would always sort into the excess)
+    missing_ids = int(df['responseid'].isna().sum())
+    if missing_ids:
+        raise ValueError(f"Data file contains {missing_ids} row(s) with a missing responseid.")
+
+    # Validate Revenue Range values: anything outside the universe columns becomes NaN in the categorical
+    revenue_range_cat = pd.Categorical(df['Revenue Range'], categories=revenue_ranges)
+    invalid_mask = revenue_range_cat.isna() & df['Revenue Range'].notna().to_numpy()
+    if invalid_mask.any():
+        invalid_revenue_ranges = df.loc[invalid_mask, 'Revenue Range'].unique()
+        raise ValueError(f"Data file contains invalid Revenue Range values: {', '.join(map(str, invalid_revenue_ranges))}. Expected values are: {', '.join(revenue_ranges)}")
+
+    # Return the data with the validated categorical so process_files doesn't need to re-encode it
+    return df.assign(**{'Revenue Range': revenue_range_cat})
 
 # Function to validate the universe file
 def validate_universe_file(df):
     required_columns = ['Industry', 'Country']
-    missing_columns = [col for col in required_columns if col not in df.columns]
+    present_columns = set(df.columns)
+    missing_columns = [col for col in required_columns if col not in present_columns]
     if missing_columns:
         raise ValueError(f"Universe file is missing required columns: {', '.join(missing_columns)}")
     
+    # Validate that each Country/Industry pair appears only once (its quotas would otherwise be ambiguous)
+    keys = df[['Country', 'Industry']].dropna()
+    duplicates = keys[keys.duplicated()].drop_duplicates()
+    if not duplicates.empty:
+        duplicate_pairs = [f"{country} / {industry}" for country, industry in duplicates.itertuples(index=False)]
+        shown = ', '.join(duplicate_pairs[:10]) + (f" (and {len(duplicate_pairs) - 10} more)" if len(duplicate_pairs) > 10 else "")
+        raise ValueError(f"Universe file contains duplicate Country/Industry rows: {shown}. Each pair must appear only once.")
+
     # Identify revenue range columns (all columns except 'Industry' and 'Country')
     revenue_ranges = [col for col in df.columns if col not in ['Industry', 'Country']]
     if not revenue_ranges:
@@ -46,75 +130,205 @@ def validate_universe_file(df):
     
     return revenue_ranges
 
+# Function to combine the categorical key columns into one int64 code per row (-1 where any key is missing)
+def _group_key_codes(df):
+    codes = np.zeros(len(df), dtype='int64')
+    missing = np.zeros(len(df), dtype=bool)
+    for col in ['Country', 'Industry', 'Revenue Range']:
+        col_codes = df[col].cat.codes.to_numpy().astype('int64')
+        codes = codes * len(df[col].cat.categories) + col_codes
+        missing |= col_codes < 0
+    codes[missing] = -1
+    return codes
+
+# Function copying the last `excess[g]` sorted IDs of each group (ending at `ends[g]`) into `out`
+def _copy_excess_slices(flat_ids, ends, excess, out_starts, out):
+    for g in range(len(ends)):
+        n = excess[g]
+        out[out_starts[g]:out_starts[g] + n] = flat_ids[ends[g] - n:ends[g]]
+
+# Numba build of the copy loop, used for integer IDs when Numba is installed
+# Serial and nogil: Streamlit runs each session in its own thread, and parallel=True can deadlock there
+# (e.g. the TBB threading layer when first launched off the main thread)
+# Cached on disk so the compile cost is paid once per machine rather than once per server process
+_copy_excess_slices_jit = njit(nogil=True, cache=True)(_copy_excess_slices) if njit is not None else None
+
+# Number of over-quota groups below which the plain Python loop beats calling (and compiling) the Numba build
+NUMBA_MIN_GROUPS = 10_000
+
+# Function to collect excess IDs from one flat, group-sorted responseid array and per-group offsets
+def _collect_excess_ids(data_df, excess_rows, excess_counts):
+    data_codes = _group_key_codes(data_df)
+    valid = data_codes >= 0
+    flat_ids = data_df['responseid'].to_numpy()[valid]
+    data_codes = data_codes[valid]
+
+    # Sort by group, then responseid, so each group's IDs form one contiguous ascending run
+    # (two argsorts rather than np.lexsort so non-numeric IDs are supported too)
+    order = np.argsort(flat_ids, kind='stable')
+    order = order[np.argsort(data_codes[order], kind='stable')]
+    flat_ids = flat_ids[order]
+    group_codes, offsets, counts = np.unique(data_codes[order], return_index=True, return_counts=True)
+
+    excess_codes = _group_key_codes(excess_rows)
+    groups = np.searchsorted(group_codes, excess_codes)
+    found = groups < len(group_codes)
+    found[found] = group_codes[groups[found]] == excess_codes[found]
+    if not found.all():
+        raise ValueError("Internal error: Excess groups could not be matched to rows in the data file")
+    ends = offsets[groups] + counts[groups]
+    out_starts = np.cumsum(excess_counts) - excess_counts
+    out = np.empty(excess_counts.sum(), dtype=flat_ids.dtype)
+    use_jit = (
+        _copy_excess_slices_jit is not None
+        and flat_ids.dtype.kind in 'iu'
+        and len(ends) >= NUMBA_MIN_GROUPS
+    )
+    if use_jit:
+        _copy_excess_slices_jit(flat_ids, ends, excess_counts, out_starts, out)
+    else:
+        _copy_excess_slices(flat_ids, ends, excess_counts, out_starts, out)
+    return out
+
+# Function to group the data file and join it with the long-form universe quotas (pandas)
+def _group_and_join(data_df, universe_df, revenue_ranges, key_dtypes):
+    # Step 1: Group the data file (indexed on the Country, Industry, Revenue Range keys)
+    grouped_data = data_df.groupby(['Country', 'Industry', 'Revenue Range'], sort=False, observed=True).agg(
+        count=('responseid', 'size')
+    )
+
+    # Step 2: Reshape the universe file to long form (one quota per Country, Industry, Revenue Range)
+    universe_wide = universe_df.set_index(['Country', 'Industry'])[revenue_ranges]
+    universe_wide.columns = pd.CategoricalIndex(revenue_ranges, dtype=key_dtypes['Revenue Range'], name='Revenue Range')
+    universe_long = universe_wide.stack(future_stack=True).rename('quota')
+
+    # Step 3: Join the grouped data with the universe file on their shared key index
+    return grouped_data.join(
+        universe_long,
+        how='left',
+        validate='one_to_one'  # Duplicate Country/Industry rows in the universe file would otherwise double-count
+    ).reset_index()
+
+# Function to group the data file and join it with the long-form universe quotas (Polars)
+def _group_and_join_polars(data_df, universe_df, revenue_ranges, key_dtypes):
+    key_columns = ['Country', 'Industry', 'Revenue Range']
+    # Join on the shared categorical codes (missing keys are -1), so key values of any type survive the round trip
+    data_pl = pl.DataFrame({col: data_df[col].cat.codes.to_numpy() for col in key_columns})
+    # Revenue range columns are renamed to their category codes so unpivot yields codes too
+    quota_columns = [str(code) for code in range(len(revenue_ranges))]
+    universe_pl = pl.from_pandas(
+        universe_df[revenue_ranges].set_axis(quota_columns, axis=1).assign(
+            Country=universe_df['Country'].cat.codes.to_numpy(),
+            Industry=universe_df['Industry'].cat.codes.to_numpy()
+        )
+    )
+
+    # maintain_order keeps groups in first-appearance order, matching the pandas groupby(sort=False) path
+    grouped = (
+        data_pl.filter(pl.all_horizontal(pl.col(key_columns) >= 0))
+        .group_by(key_columns, maintain_order=True)
+        .agg(pl.len().alias('count'))
+    )
+    universe_long = universe_pl.unpivot(
+        index=['Country', 'Industry'],
+        on=quota_columns,
+        variable_name='Revenue Range',
+        value_name='quota'
+    ).with_columns(pl.col('Revenue Range').cast(grouped.schema['Revenue Range']))
+    merged_df = grouped.join(
+        universe_long, on=key_columns, how='left', validate='1:1', maintain_order='left'
+    ).to_pandas()
+
+    # Restore the shared categorical dtypes from the codes
+    for col in key_columns:
+        merged_df[col] = pd.Categorical.from_codes(merged_df[col], dtype=key_dtypes[col])
+    return merged_df
+
+# Function to put a key column on a shared categorical dtype
+# (astype is a no-op between unordered categoricals with the same categories in a different order,
+# so columns that are already categorical are recoded explicitly to get matching codes)
+def _to_key_dtype(series, dtype):
+    if isinstance(series.dtype, CategoricalDtype):
+        return series.cat.set_categories(dtype.categories)
+    return series.astype(dtype)
+
+# Function to encode the key columns of both files with shared categorical dtypes
+def _encode_keys(data_df, universe_df, revenue_ranges):
+    key_dtypes = {
+        col: CategoricalDtype(categories=pd.concat([data_df[col], universe_df[col]]).dropna().unique())
+        for col in ['Country', 'Industry']
+    }
+    key_dtypes['Revenue Range'] = CategoricalDtype(categories=revenue_ranges)
+    data_df = data_df.assign(**{col: _to_key_dtype(data_df[col], dtype) for col, dtype in key_dtypes.items()})
+    universe_df = universe_df.assign(
+        **{col: _to_key_dtype(universe_df[col], key_dtypes[col]) for col in ['Country', 'Industry']}
+    )
+    return data_df, universe_df, key_dtypes
+
 # Function to find excess respondents and quota fulfillment stats
+@st.cache_data(show_spinner=False, hash_funcs={pd.DataFrame: _hash_dataframe})
 def process_files(data_df, universe_df, revenue_ranges):
     try:
-        # Step 1: Group the data file
-        grouped_data = data_df.groupby(['Country', 'Industry', 'Revenue Range']).agg(
-            count=('responseid', 'size'),
-            response_ids=('responseid', lambda x: sorted(list(x)))
-        ).reset_index()
-
-        # Step 2: Reshape the universe file
-        universe_df_melted = universe_df.melt(
-            id_vars=['Country', 'Industry'],
-            value_vars=revenue_ranges,
-            var_name='Revenue Range',
-            value_name='quota'
-        )
+        # Step 0: Put the key columns on shared categorical dtypes so grouping and joining work on matching int codes
+        data_df, universe_df, key_dtypes = _encode_keys(data_df, universe_df, revenue_ranges)
 
-        # Step 3: Merge the grouped data with the universe file
-        merged_df = grouped_data.merge(
-            universe_df_melted,
-            on=['Country', 'Industry', 'Revenue Range'],
-            how='left'
-        )
+        # Steps 1-3: Group the data file and join it with the long-form universe quotas
+        if pl is not None:
+            merged_df = _group_and_join_polars(data_df, universe_df, revenue_ranges, key_dtypes)
+        else:
+            merged_df = _group_and_join(data_df, universe_df, revenue_ranges, key_dtypes)
 
-        # Step 4: Calculate excess and fulfillment percentage
-        merged_df['excess'] = merged_df['count'] - merged_df['quota']
-        merged_df['excess'] = merged_df['excess'].clip(lower=0)  # Excess cannot be negative
-        merged_df['fulfillment_percentage'] = (merged_df['count'] / merged_df['quota'] * 100).clip(upper=100)
-
-        # Step 5: Identify excess respondents
-        excess_respondents = []
-        for _, row in merged_df.iterrows():
-            if row['excess'] > 0:
-                excess_ids = row['response_ids'][-int(row['excess']):]
-                for resp_id in excess_ids:
-                    excess_respondents.append({
-                        'Country': row['Country'],
-                        'Industry': row['Industry'],
-                        'Revenue Range': row['Revenue Range'],
-                        'Quota': row['quota'],
-                        'Count': row['count'],
-                        'Excess': row['excess'],
-                        'Response ID': resp_id
-                    })
-
-        # Step 6: Prepare quota fulfillment stats
-        # Filter out groups with NaN quotas (i.e., groups not in the universe file)
-        fulfillment_df = merged_df[merged_df['quota'].notna()].copy()
-        fulfillment_df['fulfillment_percentage'] = fulfillment_df['fulfillment_percentage'].round(2)
-        # Sort by fulfillment percentage (descending: closest to completion to furthest)
-        fulfillment_df = fulfillment_df.sort_values(
-            by='fulfillment_percentage',
-            ascending=False
+        # Step 4: Calculate excess and fulfillment percentage on the raw arrays
+        # Groups missing from the universe file have a NaN quota, which propagates to both columns
+        count_arr = merged_df['count'].to_numpy(dtype='int32')
+        quota_arr = merged_df['quota'].to_numpy(dtype='float64', na_value=np.nan)
+        # float32 holds whole numbers exactly only below 2**24, so quotas and excess are downcast only when they fit
+        if not (np.abs(quota_arr) >= 2**24).any():
+            quota_arr = quota_arr.astype('float32')
+        with np.errstate(divide='ignore', invalid='ignore'):
+            excess_arr = np.maximum(count_arr.astype(quota_arr.dtype) - quota_arr, 0)  # Excess cannot be negative
+            # The percentage is always computed in float64 so its 2-decimal rounding matches the displayed values exactly
+            fill_arr = np.minimum(count_arr / quota_arr.astype('float64') * 100.0, 100.0)
+        merged_df = merged_df.assign(
+            count=count_arr,
+            quota=quota_arr,
+            excess=excess_arr,
+            fulfillment_percentage=fill_arr
         )
 
-        # Ensure the columns exist before selecting
-        required_columns = ['Country', 'Industry', 'Revenue Range', 'count', 'quota', 'fulfillment_percentage']
-        missing_columns = [col for col in required_columns if col not in fulfillment_df.columns]
-        if missing_columns:
-            raise ValueError(f"Internal error: Missing columns in fulfillment DataFrame: {', '.join(missing_columns)}")
-
-        # Select columns and rename for display
-        fulfillment_df = fulfillment_df[required_columns].rename(columns={
+        # Step 5: Identify excess respondents (the last `excess` IDs of each over-quota group)
+        excess_rows = merged_df[merged_df['excess'] > 0]
+        excess_counts = excess_rows['excess'].to_numpy().astype('int64')
+        excess_ids = _collect_excess_ids(data_df, excess_rows, excess_counts)
+        # Repeat each group's row once per excess ID with a single positional take
+        row_positions = np.repeat(np.arange(len(excess_rows)), excess_counts)
+        excess_df = excess_rows.iloc[row_positions][
+            ['Country', 'Industry', 'Revenue Range', 'quota', 'count', 'excess']
+        ].rename(columns={
             'count': 'Count',
             'quota': 'Quota',
-            'fulfillment_percentage': 'Fulfillment Percentage (%)'
-        })
+            'excess': 'Excess'
+        }).reset_index(drop=True)
+        excess_df['Response ID'] = excess_ids
+
+        # Step 6: Prepare quota fulfillment stats in one chain
+        # Filter out groups with NaN quotas (i.e., groups not in the universe file), keeping only the displayed columns
+        # Sort by fulfillment percentage (descending: closest to completion to furthest)
+        fulfillment_df = (
+            merged_df.loc[
+                merged_df['quota'].notna(),
+                ['Country', 'Industry', 'Revenue Range', 'count', 'quota', 'fulfillment_percentage']
+            ]
+            .assign(fulfillment_percentage=lambda df: df['fulfillment_percentage'].round(2))
+            .sort_values(by='fulfillment_percentage', ascending=False, kind='stable')
+            .rename(columns={
+                'count': 'Count',
+                'quota': 'Quota',
+                'fulfillment_percentage': 'Fulfillment Percentage (%)'
+            })
+        )
 
-        return excess_respondents, fulfillment_df
+        return excess_df, fulfillment_df
 
     except Exception as e:
         raise ValueError(f"Error processing files: {str(e)}")
@@ -164,30 +378,36 @@ def main():
 
     if data_file and universe_file:
         try:
-            # Read the files
+            # Read the files concurrently (the parsers release the GIL for the bulk of the work)
+            # Worker threads get this session's script context so the cached reader works inside them
             with st.spinner("Reading files..."):
-                data_df = read_file(data_file)
-                universe_df = read_file(universe_file)
+                with ThreadPoolExecutor(
+                    max_workers=2,
+                    initializer=add_script_run_ctx,
+                    initargs=(None, get_script_run_ctx())
+                ) as executor:
+                    data_future = executor.submit(_read_bytes, data_file.name, data_file.getvalue())
+                    universe_future = executor.submit(_read_bytes, universe_file.name, universe_file.getvalue())
+                    data_df, universe_df = data_future.result(), universe_future.result()
 
             # Validate the universe file and get revenue ranges
             with st.spinner("Validating files..."):
                 revenue_ranges = validate_universe_file(universe_df)
-                validate_data_file(data_df, revenue_ranges)
+                data_df = validate_data_file(data_df, revenue_ranges)
 
             # Process the files
             with st.spinner("Processing files..."):
-                excess_respondents, fulfillment_df = process_files(data_df, universe_df, revenue_ranges)
+                excess_df, fulfillment_df = process_files(data_df, universe_df, revenue_ranges)
 
             # Display results
             st.header("Results")
 
             # Excess Respondents
             st.subheader("Excess Responses")
-            if excess_respondents:
-                excess_df = pd.DataFrame(excess_respondents)
+            if not excess_df.empty:
                 st.dataframe(excess_df)
                 # Download button
-                csv = excess_df.to_csv(index=False)
+                csv = _to_csv_bytes(excess_df)
                 st.download_button(
                     label="Download Excess Respondents as CSV",
                     data=csv,
@@ -202,7 +422,7 @@ def main():
             st.markdown("This table shows how much each quota is filled, sorted from closest to completion (100%) to furthest from completion (0%).")
             st.dataframe(fulfillment_df)
             # Download button
-            csv = fulfillment_df.to_csv(index=False)
+            csv = _to_csv_bytes(fulfillment_df)
             st.download_button(
                 label="Download Quota Fulfillment Stats as CSV",
                 data=csv,
@@ -0,0 +1,52 @@
+import io
+
+import pandas as pd
+import pytest
+
+import streamlit_app
+
+
+class _Upload(io.BytesIO):
+    def __init__(self, name, data):
+        super().__init__(data)
+        self.name = name
+
+
+def _load(data_csv, universe_csv):
+    universe_df = streamlit_app.read_file(_Upload('universe.csv', universe_csv))
+    data_df = streamlit_app.read_file(_Upload('data.csv', data_csv))
+    revenue_ranges = streamlit_app.validate_universe_file(universe_df)
+    data_df = streamlit_app.validate_data_file(data_df, revenue_ranges)
+    return data_df, universe_df, revenue_ranges
+
+
+# The two files list Country/Industry in different orders, so categoricals read from each get different codes
+DATA_CSV = b'responseid,Country,Industry,Revenue Range\n1,USA,Retail,A\n2,USA,Retail,A\n3,USA,Tech,A\n4,UK,Tech,B\n5,UK,Tech,B\n'
+UNIVERSE_CSV = b'Industry,Country,A,B\nTech,USA,1,0\nRetail,USA,100,0\nTech,UK,0,1\n'
+
+
+def test_group_and_join_paths_agree_on_differently_ordered_keys():
+    pytest.importorskip('polars')
+    data_df, universe_df, revenue_ranges = _load(DATA_CSV, UNIVERSE_CSV)
+    data_df, universe_df, key_dtypes = streamlit_app._encode_keys(data_df, universe_df, revenue_ranges)
+
+    merged_pandas = streamlit_app._group_and_join(data_df, universe_df, revenue_ranges, key_dtypes)
+    merged_polars = streamlit_app._group_and_join_polars(data_df, universe_df, revenue_ranges, key_dtypes)
+
+    columns = ['Country', 'Industry', 'Revenue Range', 'count', 'quota']
+    pd.testing.assert_frame_equal(
+        merged_polars[columns].astype({'count': 'int64', 'quota': 'float64'}),
+        merged_pandas[columns].astype({'count': 'int64', 'quota': 'float64'})
+    )
+
+
+def test_process_files_matches_quotas_to_their_own_groups():
+    data_df, universe_df, revenue_ranges = _load(DATA_CSV, UNIVERSE_CSV)
+    excess_df, fulfillment_df = streamlit_app.process_files(data_df, universe_df, revenue_ranges)
+
+    quotas = {
+        (row['Country'], row['Industry'], row['Revenue Range']): row['Quota']
+        for _, row in fulfillment_df.iterrows()
+    }
+    assert quotas == {('USA', 'Retail', 'A'): 100, ('USA', 'Tech', 'A'): 1, ('UK', 'Tech', 'B'): 1}
+    assert sorted(excess_df['Response ID']) == [5]